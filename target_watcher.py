@@ -1,22 +1,26 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import json
+import functools
+import hashlib
+import heapq
 import os
 import sys
 import socket
+import sqlite3
+import time
 from pathlib import Path
-from typing import List, Dict, Any
-from collections import defaultdict
+from typing import List, Dict, Any, Iterator, Optional, Union
 
-import requests
+import msgspec
 
-# Try to load environment variables from .env file
-try:
-    from dotenv import load_dotenv
-    load_dotenv("target_watcher.env", override=True)
-except Exception as e:
-    print(f"Warning: Could not load .env file: {e}", file=sys.stderr)
+# Try to load environment variables from .env file (only import dotenv if there is one)
+if os.path.exists("target_watcher.env"):
+    try:
+        from dotenv import load_dotenv
+        load_dotenv("target_watcher.env", override=True)
+    except Exception as e:
+        print(f"Warning: Could not load .env file: {e}", file=sys.stderr)
 
 # ----------------------
 # Config from environment
@@ -26,7 +30,7 @@ if not URL:
     print("ERROR: Set TARGETS_URL in environment file", file=sys.stderr)
     sys.exit(2)
 
-STATE_FILE = Path(os.getenv("STATE_FILE", str(Path(__file__).with_name("seen.json"))))
+STATE_FILE = Path(os.getenv("STATE_FILE", str(Path(__file__).with_name("seen.db"))))
 
 MONITORED_HOSTS = [
     h.strip().lower()
@@ -34,7 +38,7 @@ MONITORED_HOSTS = [
     if h.strip()
 ]
 
-USE_STATE = os.getenv("USE_STATE", "0") == "1"  # 1 = use seen.json (default), 0 = stateless
+USE_STATE = os.getenv("USE_STATE", "0") == "1"  # 1 = use seen.db (default), 0 = stateless
 
 # Slack
 SLACK_WEBHOOK = os.getenv("SLACK_WEBHOOK_URL", "").strip()
@@ -43,171 +47,437 @@ SLACK_EXAMPLES_PER_HOST = int(os.getenv("SLACK_EXAMPLES_PER_HOST", "2"))
 SLACK_MAX_HOSTS = int(os.getenv("SLACK_MAX_HOSTS", "10"))
 SLACK_SUPPRESS_EMPTY = os.getenv("SLACK_SUPPRESS_EMPTY", "1") == "1"
 SLACK_TITLE = os.getenv("SLACK_TITLE", "Target watcher")
+HITS_PER_HOST = int(os.getenv("HITS_PER_HOST", "20"))  # full hits listed per host (verbose Slack / email)
+SLACK_QUEUE_FILE = STATE_FILE.with_name("slack_queue.json")
+SLACK_MIN_INTERVAL = 1.0  # seconds between posts, Slack's per-webhook rate limit
+
+# Message templates; the hostname is looked up once instead of per message
+_HOSTNAME = socket.gethostname()
+_ERR_TEMPLATE = ":warning: Target Watcher Error :warning:\n\n*{title}*: {msg}\n_host: " + _HOSTNAME + "_"
+_VERBOSE_TEMPLATE = (
+    ":rotating_light: Oh noes, we might be under attack soon! :rotating_light:\n\n"
+    "*{title}:* {count} new match(es) on `{url}`\n"
+    "_host: " + _HOSTNAME + "_\n\n"
+    "{hits}"
+)
 
 # Email (optional – skip if only using Slack)
 SMTP_HOST = os.getenv("SMTP_HOST", "").strip()
-SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
+SMTP_USE_SSL = os.getenv("SMTP_USE_SSL", "0") == "1"  # 1 = implicit TLS (SMTP_SSL), 0 = STARTTLS
+SMTP_PORT = int(os.getenv("SMTP_PORT", "465" if SMTP_USE_SSL else "587"))
 SMTP_USER = os.getenv("SMTP_USER", "").strip()
 SMTP_PASS = os.getenv("SMTP_PASS", "").strip()
 EMAIL_FROM = os.getenv("EMAIL_FROM", "").strip()
 EMAIL_TO = os.getenv("EMAIL_TO", "").strip()  
 
+RUN_INTERVAL = int(os.getenv("RUN_INTERVAL", "0"))  # seconds between checks, 0 = run once and exit
+
+_SESSION = None
+
+
+def http_session():
+    """One pooled session for the feed fetch and all Slack posts, created on first use."""
+    global _SESSION
+    if _SESSION is None:
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        adapter = HTTPAdapter(
+            pool_connections=2,
+            pool_maxsize=4,
+            # Only idempotent requests (the feed GET) are retried, never the Slack POSTs.
+            # Retry-After is ignored so a large value cannot stall the run past its timeout.
+            max_retries=Retry(
+                total=2,
+                backoff_factor=0.3,
+                status_forcelist=[429, 500, 502, 503, 504],
+                respect_retry_after_header=False,
+            ),
+        )
+        _SESSION = requests.Session()
+        _SESSION.mount("https://", adapter)
+        _SESSION.mount("http://", adapter)
+    return _SESSION
+
+
+# ----------------------
+# Feed entries
+# ----------------------
+class Target(msgspec.Struct, frozen=True):
+    host: Optional[str] = None
+    path: Optional[str] = None
+    method: Optional[str] = None
+    type: Optional[str] = None
+    port: Any = None
+    request_id: Union[str, int, None] = None
+
+
+class HitCollector(msgspec.Struct):
+    """Per-host summary of hits, built in a single pass over the feed.
+
+    groups maps host -> [count, examples]; samples keeps at most HITS_PER_HOST
+    full targets per host, so memory is bounded by the number of unique hosts.
+    """
+    total: int = 0
+    groups: Dict[str, list] = {}
+    samples: Dict[str, List[Target]] = {}
+
+    def add(self, t: Target, host: str) -> None:
+        """Record a hit; host is the already normalized t.host."""
+        self.total += 1
+        entry = self.groups.get(host)
+        if entry is None:
+            entry = [0, []]
+            self.groups[host] = entry
+            self.samples[host] = []
+        entry[0] += 1
+        if len(entry[1]) < SLACK_EXAMPLES_PER_HOST:
+            ex = ((t.method or t.type or "").upper() + " " + (t.path or "")).strip()
+            if ex:
+                entry[1].append(ex)
+        sample = self.samples[host]
+        if len(sample) < HITS_PER_HOST:
+            sample.append(t)
+
+    def merge(self, other: "HitCollector") -> None:
+        self.total += other.total
+        for host, (count, examples) in other.groups.items():
+            entry = self.groups.setdefault(host, [0, []])
+            entry[0] += count
+            entry[1].extend(examples[:max(0, SLACK_EXAMPLES_PER_HOST - len(entry[1]))])
+            sample = self.samples.setdefault(host, [])
+            sample.extend(other.samples.get(host, [])[:max(0, HITS_PER_HOST - len(sample))])
+
 
 # ----------------------
 # State handling
 # ----------------------
-def load_state() -> Dict[str, Any]:
+SEEN_MAX = 50000  # once exceeded, the oldest ids are pruned down to SEEN_KEEP
+SEEN_KEEP = 40000
+
+
+class SeenStore:
+    """Already notified request ids in SQLite, so each run only writes the new ones.
+
+    New ids and meta values are collected in memory and written by save_state in one short
+    transaction, so no write lock is held while the feed streams or
+    notifications are sent.
+
+    The meta table holds small values kept between runs (the feed's ETag and
+    Last-Modified validators and the watchlist they were fetched for).
+    """
+
+    def __init__(self, path: str):
+        self.conn = sqlite3.connect(path, timeout=30)  # busy timeout for the final write
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS seen (rid TEXT PRIMARY KEY, ts INTEGER)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        self.new_rids: Dict[str, None] = {}  # insertion ordered, so pruning drops the oldest
+        self.new_meta: Dict[str, Optional[str]] = {}
+
+    def add(self, rid: str) -> bool:
+        """Record rid; returns True if it had not been seen before."""
+        if rid in self.new_rids:
+            return False
+        if self.conn.execute("SELECT 1 FROM seen WHERE rid = ?", (rid,)).fetchone():
+            return False
+        self.new_rids[rid] = None
+        return True
+
+    def get_meta(self, key: str) -> Optional[str]:
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key: str, value: Optional[str]) -> None:
+        """Stage a meta value (None deletes it); written by save_state."""
+        self.new_meta[key] = value
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+def load_state() -> SeenStore:
     if not USE_STATE:
         # Stateless mode: behave as if nothing has been seen
-        return {"seen_request_ids": {}}
-    if STATE_FILE.exists():
-        try:
-            return json.loads(STATE_FILE.read_text(encoding="utf-8"))
-        except Exception:
-            pass
-    return {"seen_request_ids": {}}
-
-def save_state(state: Dict[str, Any]) -> None:
+        return SeenStore(":memory:")
+    db = STATE_FILE.with_suffix(".db")  # a STATE_FILE=seen.json setting keeps working
+    try:
+        return SeenStore(str(db))
+    except sqlite3.DatabaseError as e:
+        if isinstance(e, sqlite3.OperationalError):
+            raise  # e.g. locked or unwritable: the file itself is fine
+        # Unreadable state: set it aside and start fresh rather than stopping the watcher
+        print(f"Warning: Could not open state {db} ({e}), starting with empty state", file=sys.stderr)
+        os.replace(db, db.with_suffix(".db.corrupt"))
+        return SeenStore(str(db))
+
+def save_state(seen: SeenStore) -> None:
     if not USE_STATE:
         return  # Stateless mode: don't persist anything
-    seen = state.get("seen_request_ids", {})
-    if len(seen) > 50000:
-        for k in list(seen.keys())[:10000]:
-            del seen[k]
-        state["seen_request_ids"] = seen
-    STATE_FILE.write_text(json.dumps(state, ensure_ascii=False, indent=2), encoding="utf-8")
+    with seen.conn:  # one transaction, committed on exit
+        seen.conn.executemany(
+            "INSERT OR IGNORE INTO seen VALUES (?, strftime('%s','now'))",
+            ((rid,) for rid in seen.new_rids),
+        )
+        for key, value in seen.new_meta.items():
+            if value is None:
+                seen.conn.execute("DELETE FROM meta WHERE key = ?", (key,))
+            else:
+                seen.conn.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, value))
+        (count,) = seen.conn.execute("SELECT COUNT(*) FROM seen").fetchone()
+        if count > SEEN_MAX:
+            seen.conn.execute(
+                "DELETE FROM seen WHERE rowid IN (SELECT rowid FROM seen ORDER BY ts, rowid LIMIT ?)",
+                (count - SEEN_KEEP,),
+            )
+    seen.new_rids.clear()
+    seen.new_meta.clear()
+
+
+class SlackQueue(msgspec.Struct):
+    """Hits still owed to Slack and the time of the last post, kept between runs."""
+    pending: HitCollector = msgspec.field(default_factory=HitCollector)
+    last_post_ts: float = 0.0
+
+
+_slack_queue: Optional[SlackQueue] = None
+
+
+def slack_queue() -> SlackQueue:
+    global _slack_queue
+    if _slack_queue is None:
+        _slack_queue = SlackQueue()
+        if USE_STATE and SLACK_QUEUE_FILE.exists():
+            try:
+                _slack_queue = msgspec.json.decode(SLACK_QUEUE_FILE.read_bytes(), type=SlackQueue)
+            except Exception:
+                pass
+    return _slack_queue
+
+def save_slack_queue() -> None:
+    if not USE_STATE or _slack_queue is None:
+        return
+    tmp = SLACK_QUEUE_FILE.with_suffix(".json.tmp")
+    tmp.write_bytes(msgspec.json.encode(_slack_queue))
+    os.replace(tmp, SLACK_QUEUE_FILE)
 
 
 # ----------------------
 # Helpers
 # ----------------------
+_TRIM_TABLE = str.maketrans("", "", " \t\r\n")
+
+
+@functools.lru_cache(maxsize=4096)
 def normalize_host(h: str) -> str:
-    h = (h or "").lower().strip()
-    if h.startswith("www."):
-        h = h[4:]
-    return h
-
-
-def host_matches(monitored: List[str], host: str) -> bool:
-    """Suffix match: sub.example.com matches 'example.com'."""
-    host = normalize_host(host)
-    for m in monitored:
-        m = normalize_host(m)
-        if host == m or host.endswith("." + m):
+    if not h:
+        return ""
+    h = h.translate(_TRIM_TABLE).lower()
+    return h[4:] if h.startswith("www.") else h
+
+
+# Monitored hosts as a trie over reversed labels: com -> example -> {"$": True}
+_TRIE: Dict[str, Any] = {}
+for _m in MONITORED_HOSTS:
+    _node = _TRIE
+    for _label in reversed(normalize_host(_m).split(".")):
+        _node = _node.setdefault(_label, {})
+    _node["$"] = True
+
+# Identifies the feed URL and watchlist a cached feed was checked against; a change
+# to either forces a full fetch
+_WATCHLIST_HASH = hashlib.sha256(
+    "\n".join([URL, *sorted({normalize_host(h) for h in MONITORED_HOSTS})]).encode("utf-8")
+).hexdigest()
+
+
+def host_matches(host: str) -> bool:
+    """Suffix match on a normalized host: sub.example.com matches 'example.com'."""
+    node = _TRIE
+    for label in reversed(host.split(".")):
+        node = node.get(label)
+        if node is None:
+            return False
+        if "$" in node:
             return True
     return False
 
 
-def fetch_targets(url: str) -> List[Dict[str, Any]]:
+def post_slack(text: str) -> None:
+    """Post to the webhook, waiting out SLACK_MIN_INTERVAL since the previous post."""
+    queue = slack_queue()
+    wait = SLACK_MIN_INTERVAL - (time.time() - queue.last_post_ts)
+    if wait > 0:
+        time.sleep(wait)
     try:
-        r = requests.get(url, timeout=30)
-        r.raise_for_status()
-        data = r.json()
-        return data.get("targets", [])
-    except requests.RequestException as e:
+        http_session().post(SLACK_WEBHOOK, json={"text": text}, timeout=15).raise_for_status()
+    finally:
+        queue.last_post_ts = time.time()
+
+
+def fetch_targets(url: str, seen: SeenStore) -> Iterator[Target]:
+    """Stream targets one by one instead of loading the whole feed into memory.
+
+    Sends the validators from the previous run, so an unchanged feed is a 304
+    with no body; the new validators are saved along with the seen ids. The
+    validators are skipped when TARGETS_URL or MONITORED_HOSTS changed since they
+    were stored, so a new feed or newly added hosts are checked in full.
+    """
+    import ijson
+    import requests
+    import urllib3.exceptions
+    # gzip/deflate, plus br (and zstd) when the decoder packages are installed
+    from urllib3.util.request import ACCEPT_ENCODING
+
+    headers = {"Accept-Encoding": ACCEPT_ENCODING}
+    if seen.get_meta("watchlist") == _WATCHLIST_HASH:
+        etag = seen.get_meta("etag")
+        if etag:
+            headers["If-None-Match"] = etag
+        last_modified = seen.get_meta("last_modified")
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+
+    try:
+        with http_session().get(url, headers=headers, stream=True, timeout=30) as r:
+            if r.status_code == 304:
+                return  # Feed unchanged since the last run
+            r.raise_for_status()
+            seen.set_meta("etag", r.headers.get("ETag"))
+            seen.set_meta("last_modified", r.headers.get("Last-Modified"))
+            seen.set_meta("watchlist", _WATCHLIST_HASH)
+            r.raw.decode_content = True
+            for item in ijson.items(r.raw, "targets.item", use_float=True):
+                try:
+                    yield msgspec.convert(item, Target)
+                except msgspec.ValidationError as e:
+                    print(f"Warning: Skipping malformed target {item!r}: {e}", file=sys.stderr)
+    except (requests.RequestException, urllib3.exceptions.HTTPError, ijson.JSONError) as e:
+        # Parsing reads r.raw directly, so a truncated or malformed body surfaces
+        # as urllib3 / ijson errors rather than requests exceptions
         error_msg = f"Failed to fetch targets from {url}: {str(e)}"
         print(f"ERROR: {error_msg}", file=sys.stderr)
         # Try to notify via Slack about the error
         if SLACK_WEBHOOK:
             try:
-                text = (
-                    ":warning: Target Watcher Error :warning:\n\n"
-                    f"*{SLACK_TITLE}*: {error_msg}\n"
-                    f"_host: {socket.gethostname()}_"
-                )
-                requests.post(SLACK_WEBHOOK, json={"text": text}, timeout=15)
+                post_slack(_ERR_TEMPLATE.format(title=SLACK_TITLE, msg=error_msg))
             except Exception as slack_e:
                 print(f"ERROR: Failed to send error notification to Slack: {slack_e}", file=sys.stderr)
+            finally:
+                save_slack_queue()
         raise  # Re-raise the original exception
 
 
-def format_hits(hits: List[Dict[str, Any]]) -> str:
+def format_hits(hits: HitCollector) -> str:
     """Verbose list of hits (used if SLACK_SUMMARY_ONLY=0)."""
     lines = []
-    for t in hits:
-        host = t.get("host")
-        path = t.get("path", "")
-        method = t.get("method", "") or t.get("type", "")
-        typ = t.get("type", "")
-        port = t.get("port", "")
-        rid = t.get("request_id", "")
-        lines.append(f"- {host}  {method or typ} {path or ''} (port {port})  request_id={rid}")
+    for host, sample in hits.samples.items():
+        for t in sample:
+            method = t.method or t.type or ""
+            port = "" if t.port is None else t.port
+            lines.append(f"- {t.host}  {method} {t.path or ''} (port {port})  request_id={t.request_id or ''}")
+        more = hits.groups[host][0] - len(sample)
+        if more > 0:
+            lines.append(f"- …and {more} more on {host}")
     return "\n".join(lines)
 
 
-def summarize_hits_by_host(hits: List[Dict[str, Any]]):
-    groups = defaultdict(lambda: {"count": 0, "examples": []})
-    for t in hits:
-        host = normalize_host(t.get("host", ""))
-        method = (t.get("method") or t.get("type") or "").upper()
-        path = t.get("path") or ""
-        ex = (method + " " + path).strip()
-        groups[host]["count"] += 1
-        if ex and len(groups[host]["examples"]) < SLACK_EXAMPLES_PER_HOST:
-            groups[host]["examples"].append(ex)
-    return groups
-
-
-def format_compact_slack(hits: List[Dict[str, Any]], url: str) -> str:
-    groups = summarize_hits_by_host(hits)
-    total = sum(g["count"] for g in groups.values())
+def format_compact_slack(hits: HitCollector, url: str) -> str:
+    groups = hits.groups
+    total = hits.total
     unique_hosts = len(groups)
     lines = [
     ":rotating_light: Oh noes, we might be under attack soon! :rotating_light:",
     f"*{SLACK_TITLE}:* {total} new hits / {unique_hosts} hosts\n{url}"
     ]
 
-    items = sorted(groups.items(), key=lambda kv: kv[1]["count"], reverse=True)
-    shown = 0
-    for host, info in items:
-        if shown >= SLACK_MAX_HOSTS:
-            break
-        examples = info["examples"]
+    items = heapq.nlargest(SLACK_MAX_HOSTS, groups.items(), key=lambda kv: kv[1][0])
+    for host, (count, examples) in items:
         ex_str = ", ".join(examples) if examples else ""
         if ex_str:
-            lines.append(f"• *{host}* — {info['count']} hits (e.g. {ex_str})")
+            lines.append(f"• *{host}* — {count} hits (e.g. {ex_str})")
         else:
-            lines.append(f"• *{host}* — {info['count']} hits")
-        shown += 1
+            lines.append(f"• *{host}* — {count} hits")
 
-    if unique_hosts > shown:
-        lines.append(f"…and {unique_hosts - shown} more hosts.")
+    if unique_hosts > len(items):
+        lines.append(f"…and {unique_hosts - len(items)} more hosts.")
     return "\n".join(lines)
 
 
 # ----------------------
 # Notifications
 # ----------------------
-def notify_slack(hits: List[Dict[str, Any]]) -> None:
+def notify_slack(hits: HitCollector) -> None:
     if not SLACK_WEBHOOK:
         return
-    if not hits and SLACK_SUPPRESS_EMPTY:
+    import requests
+
+    queue = slack_queue()
+    # Coalesce hits that were rate limited on a previous run into this message;
+    # queue.pending itself only changes once the outcome of the post is known
+    if queue.pending.total:
+        merged = HitCollector()
+        merged.merge(queue.pending)
+        merged.merge(hits)
+        hits = merged
+    if not hits.total and SLACK_SUPPRESS_EMPTY:
         return
     try:
         if SLACK_SUMMARY_ONLY:
             text = format_compact_slack(hits, URL or "")
         else:
-            hostname = socket.gethostname()
-            text = (
-            ":rotating_light: Oh noes, we might be under attack soon! :rotating_light:\n\n"
-        f"*{SLACK_TITLE}:* {len(hits)} new match(es) on `{URL}`\n"
-        f"_host: {hostname}_\n\n"
-        f"{format_hits(hits)}"
-    )
-        requests.post(SLACK_WEBHOOK, json={"text": text}, timeout=15).raise_for_status()
+            text = _VERBOSE_TEMPLATE.format(
+                title=SLACK_TITLE, count=hits.total, url=URL, hits=format_hits(hits)
+            )
+        post_slack(text)
+        queue.pending = HitCollector()
+    except requests.HTTPError as e:
+        if e.response is not None and e.response.status_code == 429:
+            queue.pending = hits  # Retry on the next run instead of dropping them
+        print(f"Slack notify failed: {e}", file=sys.stderr)
     except Exception as e:
         print(f"Slack notify failed: {e}", file=sys.stderr)
+    finally:
+        save_slack_queue()
+
+
+_SMTP = None  # SMTP connection kept open between runs in daemon mode
+
+
+def smtp_connect():
+    import smtplib
+
+    if SMTP_USE_SSL:
+        s = smtplib.SMTP_SSL(SMTP_HOST, SMTP_PORT, timeout=30)
+    else:
+        s = smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=30)
+        s.starttls()
+    if SMTP_USER and SMTP_PASS:
+        s.login(SMTP_USER, SMTP_PASS)
+    return s
+
+
+def smtp_close() -> None:
+    global _SMTP
+    if _SMTP is not None:
+        try:
+            _SMTP.quit()
+        except Exception:
+            pass
+        _SMTP = None
 
 
-def notify_email(hits: List[Dict[str, Any]]) -> None:
+def notify_email(hits: HitCollector) -> None:
+    global _SMTP
     if not (SMTP_HOST and EMAIL_FROM and EMAIL_TO):
         return
     from email.message import EmailMessage
     import smtplib
 
-    subject = f"[watcher] {len(hits)} new match(es)"
+    subject = f"[watcher] {hits.total} new match(es)"
     body = (
-        f"{len(hits)} new match(es) found while checking {URL}\n\n"
+        f"{hits.total} new match(es) found while checking {URL}\n\n"
         f"Monitored hosts: {', '.join(MONITORED_HOSTS)}\n\n"
         f"{format_hits(hits)}\n"
     )
@@ -218,13 +488,21 @@ def notify_email(hits: List[Dict[str, Any]]) -> None:
     msg.set_content(body)
 
     try:
-        with smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=30) as s:
-            s.starttls()
-            if SMTP_USER and SMTP_PASS:
-                s.login(SMTP_USER, SMTP_PASS)
-            s.send_message(msg)
+        if _SMTP is None:
+            _SMTP = smtp_connect()
+        try:
+            _SMTP.send_message(msg)
+        except (smtplib.SMTPServerDisconnected, smtplib.SMTPResponseException) as e:
+            # Server closed the idle connection since the last run (usually with a
+            # 421 reply first, which smtplib raises as SMTPSenderRefused): reconnect once
+            if isinstance(e, smtplib.SMTPResponseException) and e.smtp_code != 421:
+                raise
+            smtp_close()
+            _SMTP = smtp_connect()
+            _SMTP.send_message(msg)
     except Exception as e:
         print(f"Email notify failed: {e}", file=sys.stderr)
+        smtp_close()
 
 
 # ----------------------
@@ -235,36 +513,66 @@ def main():
         print("ERROR: Set MONITORED_HOSTS (e.g. MONITORED_HOSTS='op.fi,kela.fi')", file=sys.stderr)
         sys.exit(2)
 
-    state = load_state()
-    seen = state.setdefault("seen_request_ids", {})
+    seen = load_state()
+    try:
+        run_checks(seen)
+        save_state(seen)
+    finally:
+        seen.close()
+
+
+def run_checks(seen: SeenStore) -> None:
+    targets = fetch_targets(URL, seen)
+    hits = HitCollector()
 
-    targets = fetch_targets(URL)
-    hits = []
+    host_cache: Dict[str, bool] = {}  # normalized host -> matches, feeds repeat hosts a lot
 
     for t in targets:
-        if not isinstance(t, dict):
+        host = normalize_host(t.host) if t.host else ""
+        if not host:
             continue
-        host = t.get("host")
-        rid = t.get("request_id") or f"{host}:{t.get('path','')}:{t.get('type','')}:{t.get('method','')}"
-        if host and host_matches(MONITORED_HOSTS, host):
-            if rid not in seen:
-                hits.append(t)
-                seen[rid] = True
-
-    if hits:
-        notify_slack(hits)
-        notify_email(hits)
-        print(f"Found {len(hits)} new matches.")
-        save_state(state)
+        matched = host_cache.get(host)
+        if matched is None:
+            matched = host_cache[host] = host_matches(host)
+        if matched:
+            rid = str(t.request_id) if t.request_id else f"{host}:{t.path or ''}:{t.type or ''}:{t.method or ''}"
+            if seen.add(rid):
+                hits.add(t, host)
+
+    if hits.total:
+        from concurrent.futures import ThreadPoolExecutor
+
+        # Send both notifications concurrently; leaving the block waits for them
+        with ThreadPoolExecutor(max_workers=2) as ex:
+            futures = [ex.submit(notify_slack, hits), ex.submit(notify_email, hits)]
+        for f in futures:
+            f.result()  # Re-raise anything a notifier didn't handle itself
+        print(f"Found {hits.total} new matches.")
     else:
         print("No new matches.")
-        if not SLACK_SUPPRESS_EMPTY:
-            notify_slack([])
+        if not SLACK_SUPPRESS_EMPTY or slack_queue().pending.total:
+            notify_slack(hits)
+
+
+def run_forever() -> None:
+    """Daemon mode: check every RUN_INTERVAL seconds, reusing connections between runs."""
+    while True:
+        started = time.monotonic()
+        try:
+            main()
+        except Exception as e:
+            print(f"ERROR: {e}", file=sys.stderr)
+        time.sleep(max(0.0, RUN_INTERVAL - (time.monotonic() - started)))
 
 
 if __name__ == "__main__":
-    try:
-        main()
-    except Exception as e:
-        print(f"ERROR: {e}", file=sys.stderr)
-        sys.exit(1)
+    if RUN_INTERVAL > 0:
+        run_forever()
+    else:
+        try:
+            main()
+        except Exception as e:
+            print(f"ERROR: {e}", file=sys.stderr)
+            sys.exit(1)
+        finally:
+            smtp_close()